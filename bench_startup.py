@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""
+Start-up benchmark for stiler.py
+
+Runs stiler's real entry path, `main()` with a snapshot option, a few times in a fresh interpreter under
+`python -X importtime` and fails when the fastest run, from importing stiler to the option being done, takes longer
+than STARTUP_BUDGET_US or when a module that should be deferred was imported. The cumulative import time of every
+module imported directly on that path is listed, so a regression can be traced to a module. The X tools are replaced
+by canned output, so it runs without a display. The replacement imports subprocess like the real get_output does, so
+its cost is still counted.
+
+Usage: bench_startup.py [python executable]
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+
+# microseconds from importing stiler to the end of the option, including the modules it imports
+STARTUP_BUDGET_US = 25000
+
+# modules only some options or messages may import
+DEFERRED_MODULES = ("logging",)
+
+RUNS = 5
+
+# canned output of the X tools by the start of the command line
+X_OUTPUT = {
+    "wmctrl -d": "0  * DG: 1920x1080  VP: 0,0  WA: 0,0 1920x1080  Desktop 1\n"
+                 "1  - DG: 1920x1080  VP: N/A  WA: 0,0 1920x1080  Desktop 2",
+    "wmctrl -lGx": "0x01000003  0 0    0    960  1080 xterm.XTerm           host Terminal\n"
+                   "0x01200003  0 960  0    960  1080 navigator.Firefox     host Browser\n"
+                   "0x01400003  1 0    0    1920 1080 org.gnome.Nautilus.Org.gnome.Nautilus host Files",
+    "xrandr": "Monitors: 1\n 0: +*eDP-1 1920/344x1080/193+0+0  eDP-1",
+}
+
+# written to stderr before stiler is imported, the import times before it belong to the interpreter start-up
+START_MARKER = "stiler start-up begins"
+
+RUN_MAIN = """
+import time
+sys.stderr.write(START_MARKER + "\\n")
+sys.stderr.flush()
+start = time.perf_counter()
+import stiler
+
+def get_output(cmd):
+    import subprocess
+    for prefix, output in X_OUTPUT.items():
+        if cmd.startswith(prefix):
+            return output
+    return ""
+
+stiler.get_output = get_output
+sys.argv = ["stiler", "snapshot"]
+stiler.main()
+print(int((time.perf_counter() - start) * 1000000))
+print(" ".join(sorted(sys.modules)))
+"""
+
+
+def run_stiler(python, env):
+    """
+    Returns the time the entry path took in microseconds, the names of all imported modules and the cumulative
+    import time in microseconds of each module the entry path imported directly
+    """
+    script = "import sys\nX_OUTPUT = %r\nSTART_MARKER = %r\n%s" % (X_OUTPUT, START_MARKER, RUN_MAIN)
+    result = subprocess.run([python, "-X", "importtime", "-c", script],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    elapsed, modules = result.stdout.decode('utf-8').strip().split("\n")[-2:]
+
+    imports = {}
+    started = False
+    for line in result.stderr.decode('utf-8').splitlines():
+        if line == START_MARKER:
+            started = True
+        if not started or not line.startswith("import time:") or "|" not in line:
+            continue
+        _, total, name = line.split("|")
+        # nested imports are indented below the module importing them
+        if total.strip().isdigit() and not name.startswith("  "):
+            imports[name.strip()] = int(total)
+
+    return int(elapsed), set(modules.split()), imports
+
+
+def get_environment(home):
+    """
+    Returns an environment keeping config and state in the given directory, with the required programs on PATH
+    """
+    bin_dir = os.path.join(home, "bin")
+    os.makedirs(bin_dir)
+    for program in ["wmctrl", "xprop", "xwininfo", "egrep", "grep"]:
+        path = os.path.join(bin_dir, program)
+        with open(path, "w") as script:
+            script.write("#!/bin/sh\n")
+        os.chmod(path, 0o755)
+
+    env = dict(os.environ, HOME=home, XDG_RUNTIME_DIR=os.path.join(home, "run"), DISPLAY=":0",
+               XDG_STATE_HOME=os.path.join(home, "state"), XDG_CACHE_HOME=os.path.join(home, "cache"))
+    env["PATH"] = bin_dir + os.pathsep + env.get("PATH", "")
+    return env
+
+
+def main():
+    python = sys.argv[1] if len(sys.argv) > 1 else sys.executable
+
+    with tempfile.TemporaryDirectory() as home:
+        env = get_environment(home)
+        # the first run writes the config, the state and the bytecode cache, which a real session already has
+        run_stiler(python, env)
+        runs = [run_stiler(python, env) for _ in range(RUNS)]
+
+    fastest, modules, imports = min(runs, key=lambda run: run[0])
+    deferred = sorted(set(DEFERRED_MODULES) & modules)
+
+    print("stiler start-up: %d us (budget %d us)" % (fastest, STARTUP_BUDGET_US))
+    for name, total in sorted(imports.items(), key=lambda item: -item[1]):
+        print("  import %-20s %6d us" % (name, total))
+    success = True
+    if fastest > STARTUP_BUDGET_US:
+        print("start-up is over budget")
+        success = False
+    if deferred:
+        print("imported at start-up: " + ", ".join(deferred))
+        success = False
+
+    sys.exit(0 if success else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -20,13 +20,14 @@
 #                                                                          #
 ############################################################################
 
-import configparser as conf
-import logging
+# Only cheap modules are imported here, everything else is imported where it is used so that a hotkey press
+# does not pay for modules the chosen option does not need.
+import math
 import os
-import pickle
+from bisect import bisect_left, bisect_right, insort
+import re
 import sys
-from functools import reduce
-from subprocess import check_output, check_call, CalledProcessError
+import time
 
 PROGRAM_NAME = "Simple Window Tiler"
 PROGRAM_VERSION = "0.3"
@@ -60,7 +61,7 @@ class Color:
     END = "\033[0m"
 
 
-class ColorLogFormatter(logging.Formatter):
+class ColorLogFormatter:
     """A class for formatting colored logs."""
 
     FORMAT = "%(prefix)s%(msg)s%(suffix)s"
@@ -82,19 +83,82 @@ class ColorLogFormatter(logging.Formatter):
         if not hasattr(record, 'suffix'):
             record.suffix = self.LOG_LEVEL_COLOR.get(record.levelname.upper()).get('suffix')
 
+        import logging
         formatter = logging.Formatter(self.FORMAT)
         return formatter.format(record)
 
 
-log = logging.getLogger(PROGRAM_NAME)
-log.setLevel(logging.INFO)
-ch = logging.StreamHandler()
-ch.setLevel(logging.INFO)
-ch.setFormatter(ColorLogFormatter())
-log.addHandler(ch)
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
 
 
-def get_output(cmd): return check_output(cmd, shell=True).decode('utf-8').strip()
+class Log:
+    """
+    Colored logging to stderr. Messages below WARNING are only shown on a terminal or with -v, and the logging module
+    is only imported and set up once a message is actually shown.
+    """
+
+    def __init__(self):
+        self.level = INFO if sys.stderr.isatty() else WARNING
+        self.logger = None
+
+    def log(self, level, msg):
+        if level < self.level:
+            return
+
+        if self.logger is None:
+            import logging
+            self.logger = logging.getLogger(PROGRAM_NAME)
+            handler = logging.StreamHandler()
+            handler.setFormatter(ColorLogFormatter())
+            self.logger.addHandler(handler)
+
+        self.logger.setLevel(self.level)
+        self.logger.log(level, msg)
+
+    def debug(self, msg):
+        self.log(DEBUG, msg)
+
+    def info(self, msg):
+        self.log(INFO, msg)
+
+    def warning(self, msg):
+        self.log(WARNING, msg)
+
+    def error(self, msg):
+        self.log(ERROR, msg)
+
+
+log = Log()
+
+
+def get_output(cmd):
+    from subprocess import check_output
+    return check_output(cmd, shell=True).decode('utf-8').strip()
+
+
+def run_command_batches(batches):
+    """
+    Run each batch of shell commands in order in its own shell, with all the batches running in parallel
+    """
+    from subprocess import Popen, PIPE
+
+    processes = []
+    for commands in batches:
+        if commands:
+            process = Popen(["sh"], stdin=PIPE)
+            process.stdin.write("\n".join(commands).encode('utf-8'))
+            process.stdin.close()
+            processes.append(process)
+
+    for process in processes:
+        process.wait()
+
+
+def run_commands(commands):
+    """
+    Run the given shell commands in order using a single shell
+    """
+    run_command_batches([commands])
 
 
 def lfilter(f, lst): return list(filter(f, list(lst)))
@@ -103,11 +167,19 @@ def lfilter(f, lst): return list(filter(f, list(lst)))
 def lmap(f, lst): return list(map(f, list(lst)))
 
 
-def lreduce(f, lst): return reduce(f, list(lst))
+def lreduce(f, lst):
+    from functools import reduce
+    return reduce(f, list(lst))
+
+
+def get_rcfile():
+    return os.getenv('HOME') + "/.stilerrc"
 
 
 def initconfig():
-    rcfile = os.getenv('HOME') + "/.stilerrc"
+    import configparser as conf
+
+    rcfile = get_rcfile()
 
     config_defaults = {
         'BottomPadding': '3',
@@ -120,8 +192,11 @@ def initconfig():
         'Monitors': '2',
         'GridWidths': '0.5',
         'WidthAdjustment': '0.0',
-        'TempFile': '/tmp/tile_winlist',
+        'TempFile': '',
         'WindowFilter': 'on',
+        'MoveTimeout': '0.5',
+        'UndoSize': '65536',
+        'ProbeWM': 'on',
     }
 
     config = conf.RawConfigParser(config_defaults)
@@ -146,60 +221,531 @@ def v_flag():
     """
     Enable DEBUG level verbosity
     """
-    log.setLevel(logging.DEBUG)
-    ch.setLevel(logging.DEBUG)
+    log.level = DEBUG
 
 
 def has_required_programs(program_list):
     success = True
     for program in program_list:
-        try:
-            log.info("checking for " + program)
-            check_call("which " + program, shell=True)
-        except CalledProcessError as _:
+        log.info("checking for " + program)
+        # look through PATH ourselves rather than starting `which` for every program
+        if not any(os.access(os.path.join(path, program), os.X_OK) for path in os.get_exec_path()):
             log.error(program + " is required by " + PROGRAM_NAME)
             success = False
 
     return success
 
 
+# marks window fields that are fetched or computed lazily and were not yet
+PENDING = None
+
+
+class Window:
+    """
+    A window of the registry, the id and geometry are kept as integers
+    """
+
+    __slots__ = ("wid", "desktop", "x", "y", "width", "height", "wm_class", "title", "type", "state", "role", "rule")
+
+    def __init__(self, wid):
+        self.wid = wid
+        self.desktop = -1
+        self.x = self.y = self.width = self.height = 0
+        self.wm_class = self.title = ""
+        self.type = self.state = self.role = self.rule = PENDING
+
+    @property
+    def geometry(self):
+        return self.x, self.y, self.width, self.height
+
+
+class SpatialIndex:
+    """
+    The valid windows of one desktop sorted by the x and y of their centres, and the tiled ones also by area, so the
+    largest window, the window in a grid slot and the closest window in a direction are found by bisection instead
+    of looking at every window.
+    """
+
+    def __init__(self):
+        self.keys = {}
+        self.by_area = []
+        self.by_x = []
+        self.by_y = []
+
+    def add(self, window, tiled):
+        area = window.width * window.height
+        x = window.x + window.width // 2
+        y = window.y + window.height // 2
+        self.keys[window.wid] = (area, x, y, tiled)
+        if tiled:
+            insort(self.by_area, (area, window.wid))
+        insort(self.by_x, (x, window.wid))
+        insort(self.by_y, (y, window.wid))
+
+    def remove(self, wid):
+        area, x, y, tiled = self.keys.pop(wid)
+        if tiled:
+            del self.by_area[bisect_left(self.by_area, (area, wid))]
+        del self.by_x[bisect_left(self.by_x, (x, wid))]
+        del self.by_y[bisect_left(self.by_y, (y, wid))]
+
+    def update(self, window):
+        """
+        Move a window of the index to its new geometry
+        """
+        if window.wid in self.keys:
+            tiled = self.keys[window.wid][3]
+            self.remove(window.wid)
+            self.add(window, tiled)
+
+    def largest(self):
+        """
+        Returns the largest tiled window, or None
+        """
+        return self.by_area[-1][1] if self.by_area else None
+
+    def at(self, left, top, right, bottom):
+        """
+        Returns the window whose centre lies in the given rectangle, the one closest to its middle if there are
+        several, or None. Only the windows in the bisected x range of the rectangle are looked at.
+        """
+        middle_x = (left + right) // 2
+        middle_y = (top + bottom) // 2
+
+        best = None
+        best_distance = None
+        for position in range(bisect_left(self.by_x, (left, -1)), bisect_right(self.by_x, (right, float("inf")))):
+            x, wid = self.by_x[position]
+            y = self.keys[wid][2]
+            if top <= y <= bottom:
+                distance = abs(x - middle_x) + abs(y - middle_y)
+                if best_distance is None or distance < best_distance:
+                    best, best_distance = wid, distance
+
+        return best
+
+    def neighbour(self, x, y, direction, exclude):
+        """
+        Returns the closest window other than exclude whose centre is left, right, up or down of the given point, or
+        None. Distance across the direction counts double, to prefer windows in line. The scan starts at the bisection
+        point and stops once the distance along the direction alone is worse than the best window found.
+        """
+        if direction in ("left", "right"):
+            keys, main, cross, cross_key = self.by_x, x, y, 2
+        else:
+            keys, main, cross, cross_key = self.by_y, y, x, 1
+
+        if direction in ("left", "up"):
+            positions = range(bisect_left(keys, (main, -1)) - 1, -1, -1)
+        else:
+            positions = range(bisect_right(keys, (main, float("inf"))), len(keys))
+
+        best = None
+        best_distance = None
+        for position in positions:
+            key, wid = keys[position]
+            distance = abs(key - main)
+            if best_distance is not None and distance >= best_distance:
+                break
+            distance += 2 * abs(self.keys[wid][cross_key] - cross)
+            if wid != exclude and (best_distance is None or distance < best_distance):
+                best, best_distance = wid, distance
+
+        return best
+
+
+class WindowRegistry:
+    """
+    All known windows by numeric id. Records are updated in place, so a long running process keeps the same
+    records for the same windows and drops the records of windows that are gone.
+    """
+
+    def __init__(self):
+        self.windows = {}
+        self.indexes = {}
+
+    def __contains__(self, wid):
+        return wid in self.windows
+
+    def __getitem__(self, wid):
+        return self.windows[wid]
+
+    def get(self, wid):
+        return self.windows.get(wid)
+
+    def values(self):
+        return self.windows.values()
+
+    def index(self, desktop):
+        """
+        Returns the spatial index of the given desktop, built on first use and kept up to date after that. Excluded
+        windows are left out, so lookups do not have to skip them.
+        """
+        if desktop not in self.indexes:
+            index = SpatialIndex()
+            for window in lfilter(lambda y: y.desktop == desktop, self.windows.values()):
+                if is_valid_window(window.wid):
+                    index.add(window, window_rule(window.wid) in (None, "master"))
+            self.indexes[desktop] = index
+        return self.indexes[desktop]
+
+    def update(self, wid, desktop, x, y, width, height, wm_class, title):
+        self.indexes.clear()
+        window = self.windows.get(wid)
+        if window is None:
+            window = self.windows[wid] = Window(wid)
+        elif window.wm_class != wm_class or window.title != title:
+            window.rule = PENDING
+
+        window.desktop = desktop
+        window.x, window.y, window.width, window.height = x, y, width, height
+        window.wm_class = wm_class
+        window.title = title
+        # properties such as the iconic state change without notice, refetch them once per snapshot
+        window.type = window.state = window.role = PENDING
+        return window
+
+    def set_geometry(self, wid, x, y, width, height):
+        window = self.windows.get(wid)
+        if window is not None:
+            window.x, window.y, window.width, window.height = int(x), int(y), int(width), int(height)
+            if window.desktop in self.indexes:
+                self.indexes[window.desktop].update(window)
+
+    def set_desktop(self, wid, desktop):
+        window = self.windows.get(wid)
+        if window is not None:
+            self.indexes.pop(window.desktop, None)
+            self.indexes.pop(desktop, None)
+            window.desktop = desktop
+
+    def sync(self, wmctrl_output):
+        """
+        Update the registry from `wmctrl -lGx` output and return the window ids by desktop
+        """
+        win_list = {}
+        for line in wmctrl_output.split("\n"):
+            fields = line.split(None, 8)
+            if len(fields) < 8:
+                continue
+            window = self.update(int(fields[0], 16), int(fields[1]), int(fields[2]), int(fields[3]), int(fields[4]),
+                                 int(fields[5]), fields[6], fields[8] if len(fields) > 8 else "")
+            win_list.setdefault(window.desktop, []).append(window.wid)
+
+        live = set()
+        for winlist in win_list.values():
+            live.update(winlist)
+        for wid in [wid for wid in self.windows if wid not in live]:
+            del self.windows[wid]
+        self.indexes.clear()
+
+        return win_list
+
+
+Registry = WindowRegistry()
+
+
+def window_arg(window):
+    """
+    Return the given window id as accepted by wmctrl, xprop and xwininfo
+    """
+    return "0x%x" % window
+
+
+class WindowRules:
+    """
+    Window rules from the [rules] section of .stilerrc, compiled into an index of exact (field, value) keys with
+    regular expressions as a fallback.
+
+    Each rule is written as `name = <field> <pattern> <action>` where field is one of class, title, type or role,
+    a pattern starting with `~` is a regular expression and action is exclude, float, master or slot:<grid option>.
+    """
+
+    FIELDS = {"class": "wm_class", "title": "title", "type": "type", "role": "role"}
+    ACTIONS = ("exclude", "float", "master")
+
+    def __init__(self):
+        self.exact = {}
+        self.patterns = []
+        self.needs_properties = False
+
+    def add(self, order, rule):
+        parts = rule.split()
+        field = parts[0].lower() if parts else ""
+        pattern = " ".join(parts[1:-1])
+        action = parts[-1].lower() if parts else ""
+
+        if field not in self.FIELDS or not pattern or not (
+                action in self.ACTIONS or (action.startswith("slot:") and action[5:] in GRID_SLOTS)):
+            log.warning("Ignoring invalid rule: " + rule)
+            return
+
+        if field in ("type", "role"):
+            self.needs_properties = True
+
+        if pattern.startswith("~"):
+            try:
+                self.patterns.append((order, field, re.compile(pattern[1:], re.IGNORECASE), action))
+            except re.error as err:
+                log.warning("Ignoring rule with invalid pattern: " + rule + " (" + str(err) + ")")
+        else:
+            self.exact.setdefault((field, pattern.lower()), (order, action))
+
+    def match(self, window):
+        """
+        Return the action of the first matching rule for the given window record, or None
+        """
+        if not self.exact and not self.patterns:
+            return None
+
+        hits = []
+        for field in self.FIELDS:
+            for value in self.values(window, field):
+                hit = self.exact.get((field, value.lower()))
+                if hit is not None:
+                    hits.append(hit)
+        if hits:
+            return min(hits)[1]
+
+        for _, field, pattern, action in self.patterns:
+            for value in self.values(window, field):
+                if pattern.search(value):
+                    return action
+
+        return None
+
+    def values(self, window, field):
+        """
+        Return the values of a window a rule on the given field is matched against
+        """
+        value = getattr(window, self.FIELDS[field]) or ""
+        if field == "class" and "." in value:
+            # wmctrl reports WM_CLASS as instance.Class, allow rules on either half
+            return [value] + split_wm_class(value)
+        return [value]
+
+
+def split_wm_class(value):
+    """
+    Split an instance.Class value as reported by wmctrl in to instance and class. Both halves may contain dots, as
+    in org.gnome.Nautilus.Org.gnome.Nautilus, so the dot between two halves that only differ in case is preferred.
+    """
+    middle = len(value) // 2
+    if value[middle:middle + 1] == "." and value[:middle].lower() == value[middle + 1:].lower():
+        return [value[:middle], value[middle + 1:]]
+    return value.rsplit(".", 1)
+
+
+def compile_rules(config):
+    import configparser as conf
+
+    rules = WindowRules()
+    if config.has_section("rules"):
+        # the items of config include its defaults and hide rules named like a default, read them without defaults.
+        # A section name can not span lines, so no section of the file becomes the default section of this parser.
+        rules_config = conf.RawConfigParser(default_section="\n")
+        rules_config.read(get_rcfile())
+        for order, (_, rule) in enumerate(rules_config.items("rules")):
+            rules.add(order, rule)
+
+    log.debug("compiled %d exact and %d pattern rules" % (len(rules.exact), len(rules.patterns)))
+    return rules
+
+
+def load_window_properties(windows):
+    """
+    Fetch type, state and role of all the given windows using a single shell invocation
+    """
+    script = "; ".join("echo @" + window_arg(window) + "; xprop -id " + window_arg(window) +
+                       " _NET_WM_WINDOW_TYPE WM_STATE WM_WINDOW_ROLE" for window in windows)
+    output = get_output("(" + script + ") 2>/dev/null; true")
+
+    window = None
+    for line in output.split("\n"):
+        line = line.strip()
+        if line.startswith("@"):
+            window = Registry.get(int(line[1:], 16))
+            if window is not None:
+                window.type = window.state = window.role = ""
+        elif window is None:
+            continue
+        elif line.startswith("_NET_WM_WINDOW_TYPE(ATOM)"):
+            window.type = line.split("=", 1)[1].split(",")[0].strip().replace("_NET_WM_WINDOW_TYPE_", "")
+        elif line.startswith("window state:"):
+            window.state = line.split(":", 1)[1].strip()
+        elif line.startswith("WM_WINDOW_ROLE(STRING)"):
+            window.role = line.split("=", 1)[1].strip().strip('"')
+
+
+def window_record(window):
+    """
+    Return the registry record of the given window, adding an empty one for windows wmctrl did not list
+    """
+    record = Registry.get(window)
+    if record is None:
+        record = Registry.update(window, -1, 0, 0, 0, 0, "", "")
+    return record
+
+
+def get_window_properties(window):
+    """
+    Return the registry record of the given window, fetching properties of the current desktop once
+    """
+    record = window_record(window)
+    if record.type is PENDING:
+        load_window_properties(set(WinList.get(Desktop, [])) | {window})
+        if record.type is PENDING:
+            record.type = record.state = record.role = ""
+    return record
+
+
+def window_rule(window):
+    """
+    Return the rule action that applies to the given window, or None
+    """
+    record = get_window_properties(window) if Rules.needs_properties else window_record(window)
+    if record.rule is PENDING:
+        record.rule = Rules.match(record) or ""
+        if record.rule:
+            log.debug("%s matched rule %s" % (window_arg(window), record.rule))
+    return record.rule or None
+
+
 def is_valid_window(window):
+    if window_rule(window) == "exclude":
+        return False
+
     if WindowFilter:
-        window_type = get_output("xprop -id " + window + " _NET_WM_WINDOW_TYPE | cut -d_ -f10").split("\n")[0]
-        window_state = get_output("xprop -id " + window +
-                                  " WM_STATE | grep \"window state\" | cut -d: -f2").split("\n")[0].lstrip()
-        log.debug("%s is type %s, state %s" % (window, window_type, window_state))
-        if window_type == "UTILITY" or window_type == "DESKTOP" or window_state == "Iconic" or window_type == "DOCK":
+        record = get_window_properties(window)
+        log.debug("%s is type %s, state %s" % (window_arg(window), record.type, record.state))
+        if record.type in ("UTILITY", "DESKTOP", "DOCK") or record.state == "Iconic":
             return False
 
     return True
 
 
+def is_tiled_window(window):
+    """
+    Return True if the given window takes part in the tiling layouts
+    """
+    return window_rule(window) in (None, "master") and is_valid_window(window)
+
+
 def initialize():
     desk_output = get_output("wmctrl -d").split("\n")
-    desk_list = [line.split()[0] for line in desk_output]
+    desk_list = [int(line.split()[0]) for line in desk_output]
 
     current = lfilter(lambda x: x.split()[1] == "*", desk_output)[0].split()
 
-    desktop = current[0]
+    desktop = int(current[0])
+    screen = current[3]
     width = current[8].split("x")[0]
     height = current[8].split("x")[1]
     orig_x = current[7].split(",")[0]
     orig_y = current[7].split(",")[1]
 
-    win_output = get_output("wmctrl -lG").split("\n")
-    win_list = {}
+    win_list = Registry.sync(get_output("wmctrl -lGx"))
+    win_list = {desk: win_list.get(desk, []) for desk in desk_list}
 
-    for desk in desk_list:
-        win_list[desk] = lmap(lambda y: hex(int(y.split()[0], 16)), lfilter(lambda x: x.split()[1] == desk, win_output))
+    return desktop, screen, orig_x, orig_y, width, height, win_list
 
-    return desktop, orig_x, orig_y, width, height, win_list
+
+def query_monitors():
+    """
+    Return the [x, y, width, height] of every RandR monitor, or an empty list when xrandr is not available
+    """
+    from subprocess import CalledProcessError
+
+    try:
+        output = get_output("xrandr --listmonitors 2>/dev/null")
+    except CalledProcessError as _:
+        return []
+
+    monitors = []
+    for line in output.split("\n")[1:]:
+        match = re.search(r"(\d+)/\d+x(\d+)/\d+\+(-?\d+)\+(-?\d+)", line)
+        if match:
+            width, height, x, y = lmap(int, match.groups())
+            monitors.append((x, y, width, height))
+
+    return sorted(monitors)
+
+
+def get_monitors(fingerprint, refresh=False):
+    """
+    Return the RandR monitors, queried once and cached until the given screen fingerprint changes
+    """
+    cache = retrieve(TempFile + "_monitors")
+    if not refresh and cache.get("fingerprint") == fingerprint:
+        return cache["monitors"]
+
+    monitors = query_monitors()
+    log.debug("detected monitors: %s" % monitors)
+    store({"fingerprint": fingerprint, "monitors": monitors}, TempFile + "_monitors")
+    return monitors
+
+
+def get_monitor_areas(monitors):
+    """
+    Return the usable area of each monitor, clipped to the padded work area. Without RandR information the work
+    area is split evenly in to the configured number of monitors.
+    """
+    if not monitors:
+        width = MaxWidth / Monitors
+        return [(OrigX + int(width * n), OrigY, int(width), MaxHeight) for n in range(0, Monitors)]
+
+    areas = []
+    for x, y, width, height in monitors:
+        left = max(x, OrigX)
+        top = max(y, OrigY)
+        right = min(x + width, OrigX + MaxWidth)
+        bottom = min(y + height, OrigY + MaxHeight)
+        if right > left and bottom > top:
+            areas.append((left, top, right - left, bottom - top))
+
+    return areas or [(OrigX, OrigY, MaxWidth, MaxHeight)]
+
+
+def get_monitor_at(x, y):
+    """
+    Return the index of the monitor area containing the given point, or the closest one
+    """
+    def distance(area):
+        dx = max(area[0] - x, 0, x - area[0] - area[2] + 1)
+        dy = max(area[1] - y, 0, y - area[1] - area[3] + 1)
+        return dx * dx + dy * dy
+
+    return min(range(0, len(MonitorAreas)), key=lambda n: distance(MonitorAreas[n]))
+
+
+def get_window_monitor(window):
+    """
+    Return the index of the monitor area the centre of the given window is on
+    """
+    record = Registry.get(window)
+    if record is None or not record.width:
+        x, y = get_window_x_y(window)
+        return get_monitor_at(x, y)
+    return get_monitor_at(record.x + record.width // 2, record.y + record.height // 2)
+
+
+# window a batch step targets instead of the active window
+TargetWindow = 0
+
+
+def get_focused_window():
+    """
+    Returns the window a step targets, the active window if there is no target, whether it is tiled or not
+    """
+    if TargetWindow:
+        return TargetWindow
+    return int(get_output("xprop -root _NET_ACTIVE_WINDOW | cut -d' ' -f5 | cut -d',' -f1"), 16)
 
 
 def get_active_window():
-    active = get_output("xprop -root _NET_ACTIVE_WINDOW | cut -d' ' -f5 | cut -d',' -f1")
+    active = get_focused_window()
     if is_valid_window(active):
-        log.debug("obtained active window: '" + str(active) + "'")
+        log.debug("obtained active window: '" + window_arg(active) + "'")
         return active
     else:
         return 0
@@ -209,34 +755,106 @@ def get_window_width_height(window_id):
     """
     return the given window's [width, height]
     """
-    return get_output(" xwininfo -id " + window_id + " | egrep \"Height|Width\" | cut -d: -f2 | tr -d \" \"").split(
-        "\n")
+    return lmap(int, get_output(" xwininfo -id " + window_arg(window_id) +
+                                " | egrep \"Height|Width\" | cut -d: -f2 | tr -d \" \"").split("\n"))
 
 
 def get_window_x_y(windowid):
     """
     return the given window's [x,y] position
     """
-    return get_output("xwininfo -id " + windowid + " | grep 'Corners' | cut -d' ' -f5 | cut -d'+' -f2,3").split("+")
+    return lmap(int, get_output("xwininfo -id " + window_arg(windowid) +
+                                " | grep 'Corners' | cut -d' ' -f5 | cut -d'+' -f2,3").split("+"))
+
+
+# while a batch runs, stored objects are kept here and written once at the end
+PendingStores = None
 
 
 def store(ob, file: str):
-    with open(file, 'wb+') as f:
+    import pickle
+
+    if PendingStores is not None:
+        PendingStores[file] = ob
+        return
+
+    # write a new file and rename it over the old one, so readers never see a partially written file
+    temp_file = file + "." + str(os.getpid())
+    with open(temp_file, 'wb') as f:
         pickle.dump(ob, f)
+    os.replace(temp_file, file)
 
 
 def retrieve(file: str):
+    import pickle
+
+    if PendingStores is not None and file in PendingStores:
+        return PendingStores[file]
+
     try:
-        with open(file, 'rb+') as f:
+        with open(file, 'rb') as f:
             obj = pickle.load(f)
         return obj
-    except (OSError, IOError, EOFError) as _:
-        with open(file, 'wb+'):
-            pass
+    except (OSError, IOError, EOFError, pickle.UnpicklingError) as _:
         dc = {}
         return dc
 
 
+# the TempFile of earlier versions, shared by every user and display on the host
+LEGACY_TEMP_FILE = "/tmp/tile_winlist"
+
+
+def get_display_name():
+    """
+    Returns the current display as usable in a file name
+    """
+    return re.sub(r"[^\w.:-]", "_", os.getenv("DISPLAY") or "nodisplay")
+
+
+def get_state_dir():
+    """
+    Returns the directory holding the state of the current user and display, created on first use. It is cleared at
+    logout, so only state that is worthless after a new login is kept here.
+    """
+    runtime_dir = os.getenv("XDG_RUNTIME_DIR") or os.path.join("/tmp", "stiler-" + str(os.getuid()))
+    state_dir = os.path.join(runtime_dir, "stiler", get_display_name())
+
+    # intermediate directories are created with the default mode, so create the private one first
+    os.makedirs(runtime_dir, mode=0o700, exist_ok=True)
+    if os.stat(runtime_dir).st_uid != os.getuid():
+        log.error(runtime_dir + " is not owned by the current user")
+        sys.exit(1)
+    os.makedirs(state_dir, mode=0o700, exist_ok=True)
+
+    return state_dir
+
+
+def get_lasting_file(variable, default_dir, *names):
+    """
+    Returns a file below the given XDG base directory, or its default in the home directory, that outlives the
+    login session. Its directory is created on first use.
+    """
+    base_dir = os.getenv(variable) or os.path.join(os.path.expanduser("~"), default_dir)
+    path = os.path.join(base_dir, "stiler", *names)
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    return path
+
+
+def get_snapshot_file():
+    """
+    Returns the file holding the snapshot of the current display, kept across logins and reboots for restoring a
+    session after a crash
+    """
+    return get_lasting_file("XDG_STATE_HOME", os.path.join(".local", "state"), get_display_name(), "snapshot")
+
+
+def get_wm_cache_file():
+    """
+    Returns the file caching the move strategy of every window manager by name and version
+    """
+    return get_lasting_file("XDG_CACHE_HOME", ".cache", "wm")
+
+
 def get_width_constant(width, width_constant_array):
     """
     Returns the current closest width constant from the given constant_array and given current width
@@ -244,17 +862,17 @@ def get_width_constant(width, width_constant_array):
     return min(lmap(lambda y: [abs(y - width), y], width_constant_array))[1]
 
 
-def get_next_width(current_width, width_array):
+def get_next_width(current_width, width_array, monitor, step=1):
     """
-    Returns the next width to use based on the given current width, and width constants
+    Returns the next width to use based on the given current width, width constants and monitor
     """
-    active_width = float(current_width) / MaxWidth
+    active_width = float(current_width) / monitor[2]
 
     active_width_constant = width_array.index(get_width_constant(active_width, width_array))
 
-    width_multiplier = width_array[(active_width_constant + 1) % len(width_array)]
+    width_multiplier = width_array[(active_width_constant + step) % len(width_array)]
 
-    return int((MaxWidth - (WinBorder * 2)) * width_multiplier)
+    return int((monitor[2] - (WinBorder * 2)) * width_multiplier)
 
 
 def persist_layout(layout_function_name: str):
@@ -265,41 +883,41 @@ def persist_layout(layout_function_name: str):
     log.info("Persisted last used layout: " + layout_function_name)
 
 
-def get_simple_tile(wincount):
-    persist_layout("get_simple_tile")
+def get_simple_tile(wincount, area):
+    orig_x, orig_y, max_width, max_height = area
     rows = wincount - 1
     layout = []
     if rows == 0:
-        layout.append((OrigX, OrigY, MaxWidth, MaxHeight - WinTitle - WinBorder))
+        layout.append((orig_x, orig_y, max_width, max_height - WinTitle - WinBorder))
         return layout
     else:
-        layout.append((OrigX, OrigY, int(MaxWidth * MwFactor), MaxHeight - WinTitle - WinBorder))
+        layout.append((orig_x, orig_y, int(max_width * MwFactor), max_height - WinTitle - WinBorder))
 
-    x = OrigX + int((MaxWidth * MwFactor) + (2 * WinBorder))
-    width = int((MaxWidth * (1 - MwFactor)) - 2 * WinBorder)
-    height = int(MaxHeight / rows - WinTitle - WinBorder)
+    x = orig_x + int((max_width * MwFactor) + (2 * WinBorder))
+    width = int((max_width * (1 - MwFactor)) - 2 * WinBorder)
+    height = int(max_height / rows - WinTitle - WinBorder)
 
     for n in range(0, rows):
-        y = OrigY + int((MaxHeight / rows) * n)
+        y = orig_y + int((max_height / rows) * n)
         layout.append((x, y, width, height))
 
     return layout
 
 
-def get_column_tile(wincount):
-    persist_layout("get_column_tile")
+def get_column_tile(wincount, area):
+    orig_x, orig_y, max_width, max_height = area
     columns = wincount - 1
     layout = []
     if columns == 0:
-        layout.append((OrigX, OrigY, MaxWidth, MaxHeight - WinTitle - WinBorder))
+        layout.append((orig_x, orig_y, max_width, max_height - WinTitle - WinBorder))
         return layout
     else:
-        layout.append((OrigX, OrigY, int(MaxWidth * MwFactor), MaxHeight - WinTitle - WinBorder))
+        layout.append((orig_x, orig_y, int(max_width * MwFactor), max_height - WinTitle - WinBorder))
 
-    x0 = OrigX + int((MaxWidth * MwFactor) + (2 * WinBorder))
-    y = OrigY
-    height = int(MaxHeight - WinBorder - WinTitle)
-    width = int((MaxWidth * (1 - MwFactor)) / columns - 2 * WinBorder)
+    x0 = orig_x + int((max_width * MwFactor) + (2 * WinBorder))
+    y = orig_y
+    height = int(max_height - WinBorder - WinTitle)
+    width = int((max_width * (1 - MwFactor)) / columns - 2 * WinBorder)
 
     for n in range(0, columns):
         x = x0 + (width + WinBorder) * n
@@ -308,32 +926,58 @@ def get_column_tile(wincount):
     return layout
 
 
-def get_vertical_tile(wincount):
-    persist_layout("get_vertical_tile")
+def get_vertical_tile(wincount, area):
+    orig_x, orig_y, max_width, max_height = area
     layout = []
-    y = OrigY
-    width = int(MaxWidth / wincount)
-    height = MaxHeight - WinTitle - WinBorder
+    y = orig_y
+    width = int(max_width / wincount)
+    height = max_height - WinTitle - WinBorder
     for n in range(0, wincount):
-        x = OrigX + n * width
+        x = orig_x + n * width
         layout.append((x, y, width, height))
 
     return layout
 
 
-def get_horiz_tile(wincount):
-    persist_layout("get_horiz_tile")
+def get_horiz_tile(wincount, area):
+    orig_x, orig_y, max_width, max_height = area
     layout = []
-    x = OrigX
-    height = int(MaxHeight / wincount - WinTitle - WinBorder)
-    width = MaxWidth
+    x = orig_x
+    height = int(max_height / wincount - WinTitle - WinBorder)
+    width = max_width
     for n in range(0, wincount):
-        y = OrigY + int((MaxHeight / wincount) * n)
+        y = orig_y + int((max_height / wincount) * n)
         layout.append((x, y, width, height))
 
     return layout
 
 
+def get_grid_rects(wincount, area, fill_last_row):
+    """
+    Returns the border and title adjusted rectangles of a grid of wincount windows over the given area, all windows
+    computed at once. With fill_last_row the windows of an incomplete last row share its full width.
+    """
+    orig_x, orig_y, max_width, max_height = area
+    columns = int(math.ceil(math.sqrt(wincount)))
+    rows = int(math.ceil(wincount / columns))
+    last_columns = wincount - (rows - 1) * columns if fill_last_row else columns
+    cell_height = max_height / rows
+
+    height = int(cell_height - WinTitle - WinBorder)
+    cell_widths = [max_width / columns] * (rows - 1) + [max_width / last_columns]
+    return [(orig_x + int(column * cell_widths[row]), orig_y + int(row * cell_height),
+             int(cell_widths[row] - 2 * WinBorder), height)
+            for row, column in (divmod(n, columns) for n in range(0, wincount))]
+
+
+def get_grid_tile(wincount, area):
+    return get_grid_rects(wincount, area, False)
+
+
+def get_mosaic_tile(wincount, area):
+    return get_grid_rects(wincount, area, True)
+
+
 def retrieve_last_used_layout():
     fnc = retrieve(TempFile + "_last_layout").get("layout", "get_simple_tile")
     log.info("Retrieved last used layout: " + fnc)
@@ -343,12 +987,13 @@ def retrieve_last_used_layout():
     return get_simple_tile
 
 
-def get_max_all(wincount):
+def get_max_all(wincount, area):
+    orig_x, orig_y, max_width, max_height = area
     layout = []
-    x = OrigX
-    y = OrigY
-    height = MaxHeight - WinTitle - WinBorder
-    width = MaxWidth
+    x = orig_x
+    y = orig_y
+    height = max_height - WinTitle - WinBorder
+    width = max_width
     for n in range(0, wincount):
         layout.append((x, y, width, height))
 
@@ -356,58 +1001,291 @@ def get_max_all(wincount):
 
 
 def move_active(PosX, PosY, Width, Height):
-    windowid = ":ACTIVE:"
+    get_strategy(probe=True)
+    windowid = TargetWindow or ":ACTIVE:"
     move_window(windowid, PosX, PosY, Width, Height)
 
 
-def move_window(windowid, PosX, PosY, Width, Height):
+# the move sequence every window manager accepts
+SAFE_STRATEGY = {"combined": False, "unmaximize": True}
+
+# the safe sequence, used until a layout or move option had the chance to probe the window manager
+UNPROBED_STRATEGY = dict(SAFE_STRATEGY)
+
+# window managers known to need the safe sequence, by lower case name
+KNOWN_STRATEGIES = {"metacity": SAFE_STRATEGY}
+
+# the move strategy of this run, looked up on the first move
+Strategy = None
+
+
+def move_window_commands(windowid, PosX, PosY, Width, Height, strategy=None):
     """
-    Resizes and moves the given window to the given position and dimensions
+    Returns the wmctrl commands that resize and move the given window to the given position and dimensions, using
+    the steps the given or detected window manager strategy needs
     """
+    strategy = strategy or get_strategy()
     PosX = int(PosX)
     PosY = int(PosY)
 
-    log.debug("moving window: %s to (%s,%s,%s,%s) " % (windowid, PosX, PosY, Width, Height))
-
     if windowid == ":ACTIVE:":
         window = "-r " + windowid
     else:
-        window = "-i -r " + windowid
+        window = "-i -r " + window_arg(windowid)
+
+    log.debug("moving window: %s to (%s,%s,%s,%s) " % (window, PosX, PosY, Width, Height))
+
+    commands = []
+    if strategy["unmaximize"]:
+        commands.append("wmctrl " + window + " -b remove,maximized_vert,maximized_horz")
+
+    if strategy["combined"]:
+        commands.append("wmctrl " + window + " -e 0," + str(max(PosX, 0)) + "," + str(max(PosY, 0)) + "," +
+                        str(Width) + "," + str(Height))
+    else:
+        # NOTE: metacity doesn't like resizing and moving in the same step
+        # resize
+        commands.append("wmctrl " + window + " -e 0,-1,-1," + str(Width) + "," + str(Height))
+        # move
+        commands.append("wmctrl " + window + " -e 0," + str(max(PosX, 0)) + "," + str(max(PosY, 0)) + ",-1,-1")
 
-    # NOTE: metacity doesn't like resizing and moving in the same step
-    # unmaximize
-    os.system("wmctrl " + window + " -b remove,maximized_vert,maximized_horz")
-    # resize
-    command = "wmctrl " + window + " -e 0,-1,-1," + str(Width) + "," + str(Height)
-    os.system(command)
-    # move
-    command = "wmctrl " + window + " -e 0," + str(max(PosX, 0)) + "," + str(max(PosY, 0)) + ",-1,-1"
-    os.system(command)
     # set properties
-    command = "wmctrl " + window + " -b remove,hidden,shaded"
-    os.system(command)
+    commands.append("wmctrl " + window + " -b remove,hidden,shaded")
+    return commands
+
+
+def move_window(windowid, PosX, PosY, Width, Height):
+    """
+    Resizes and moves the given window to the given position and dimensions
+    """
+    run_commands(move_window_commands(windowid, PosX, PosY, Width, Height))
+    if windowid != ":ACTIVE:":
+        Registry.set_geometry(windowid, *get_reported_geometry(PosX, PosY, Width, Height))
+
+
+def pipeline_commands(moves):
+    """
+    Interleave the commands of the given (window, x, y, width, height) moves step by step, so the window manager
+    handles a step of one window while the same step is issued for the others
+    """
+    command_lists = [move_window_commands(*move) for move in moves]
+    return [command for step in zip(*command_lists) for command in step]
+
+
+def get_window_geometries():
+    """
+    Return the current geometry of every window by id
+    """
+    geometries = {}
+    for line in get_output("wmctrl -lG").split("\n"):
+        fields = line.split()
+        if len(fields) >= 6:
+            geometries[int(fields[0], 16)] = tuple(lmap(int, fields[2:6]))
+    return geometries
+
+
+def is_in_place(geometry, target):
+    """
+    Compare a reported geometry with a requested one, allowing for decorations and size increments
+    """
+    tolerance = WinTitle + 2 * WinBorder
+    return all(abs(reported - int(requested)) <= tolerance for reported, requested in zip(geometry, target))
+
+
+# polls a moved window has to keep the same geometry to count as settled, the window manager may handle the resize
+# and the move of a window separately
+SETTLE_POLLS = 2
+
+
+def wait_for_moves(moves):
+    """
+    Poll the window geometries until the window manager followed all the given moves or MoveTimeout passed,
+    returns the moves of the windows that did not move at all. A window that moved but settled elsewhere, for
+    example because of a minimum or fixed size, is taken where it is instead of being waited for.
+    """
+    deadline = time.monotonic() + MoveTimeout
+    pending = {move[0]: move for move in moves}
+    start = {wid: Registry[wid].geometry for wid in pending if wid in Registry and Registry[wid].width}
+    # the last reported geometry of each window and for how many polls it stayed the same
+    last = {}
+    while pending:
+        geometries = get_window_geometries()
+        for wid in list(pending):
+            geometry = geometries.get(wid)
+            if geometry is None:
+                # closed in the meantime
+                del pending[wid]
+            elif is_in_place(geometry, pending[wid][1:]) or (
+                    geometry != start.get(wid) and last.get(wid) == (geometry, SETTLE_POLLS)):
+                Registry.set_geometry(wid, *geometry)
+                del pending[wid]
+            elif last.get(wid, (None,))[0] == geometry:
+                last[wid] = (geometry, last[wid][1] + 1)
+            else:
+                last[wid] = (geometry, 1)
+
+        if pending and time.monotonic() >= deadline:
+            break
+        time.sleep(0.02)
+
+    return list(pending.values())
+
+
+def get_reported_move(window, geometry):
+    """
+    Returns the move that places the given window at a geometry as reported by wmctrl
+    """
+    x, y, width, height = geometry
+    # wmctrl reports the client position, adjust for the decorations like swap_windows does
+    return window, x - WinBorder / 2, y - WinBorder / 2 - WinTitle, width, height
+
+
+def get_reported_geometry(PosX, PosY, Width, Height):
+    """
+    Returns the geometry wmctrl reports for a window moved to the given position and dimensions, the inverse of
+    get_reported_move. The registry only keeps geometries as reported by wmctrl.
+    """
+    return max(int(PosX), 0) + WinBorder / 2, max(int(PosY), 0) + WinBorder / 2 + WinTitle, Width, Height
+
+
+def move_windows(batches):
+    """
+    Resizes and moves the windows of each batch of (window, x, y, width, height) moves, batches run in parallel
+    """
+    run_command_batches([pipeline_commands(moves) for moves in batches])
+
+    stragglers = wait_for_moves([move for moves in batches for move in moves])
+    if stragglers:
+        log.debug("%d windows did not follow, moving them step by step" % len(stragglers))
+        run_commands([command for move in stragglers for command in move_window_commands(*move, SAFE_STRATEGY)])
+        for move in stragglers:
+            Registry.set_geometry(move[0], *get_reported_geometry(*move[1:]))
 
 
 def raise_window(windowid):
+    """
+    Switch to the given window's desktop, raise it and focus it
+    """
     if windowid == ":ACTIVE:":
         command = "wmctrl -a :ACTIVE: "
     else:
-        command = "wmctrl -i -a " + windowid
+        command = "wmctrl -i -a " + window_arg(windowid)
 
     os.system(command)
 
 
-def get_next_posx(current_x, new_width):
-    if current_x < MaxWidth / Monitors:
-        if new_width < MaxWidth / Monitors - WinBorder:
-            PosX = OrigX + new_width
-        else:
-            PosX = OrigX
+def get_window_manager():
+    """
+    Returns the name of the running window manager and a version string that changes when it is upgraded
+    """
+    # xprop prints the id after "# ", the space has to go or xprop rejects it as an invalid window id
+    output = get_output("xprop -id \"$(xprop -root _NET_SUPPORTING_WM_CHECK | cut -d'#' -f2 | tr -d ' ')\" "
+                        "_NET_WM_NAME _NET_WM_PID 2>/dev/null; true")
+    name = ""
+    version = ""
+    for line in output.split("\n"):
+        if line.startswith("_NET_WM_NAME(") and "=" in line:
+            name = line.split("=", 1)[1].strip().strip('"')
+        elif line.startswith("_NET_WM_PID(") and "=" in line:
+            # window managers do not publish a version, the executable and its modification time stand in for it
+            executable = "/proc/" + line.split("=", 1)[1].strip() + "/exe"
+            try:
+                version = os.path.realpath(executable) + "@" + str(int(os.stat(executable).st_mtime))
+            except OSError as _:
+                pass
+
+    return name, version
+
+
+def is_maximized(window):
+    return "MAXIMIZED" in get_output("xprop -id " + window_arg(window) + " _NET_WM_STATE 2>/dev/null; true")
+
+
+def probe_move_strategy(window):
+    """
+    Find out with the given window which steps of the move sequence the window manager needs
+    """
+    strategy = dict(SAFE_STRATEGY)
+    original = get_window_geometries().get(window)
+    if original is None:
+        return strategy
+    was_maximized = is_maximized(window)
+
+    targets = [(window, OrigX + MaxWidth // 4, OrigY + MaxHeight // 4, MaxWidth // 2, MaxHeight // 2),
+               (window, OrigX, OrigY, MaxWidth // 3, MaxHeight // 3)]
+
+    def follows(commands, target):
+        run_commands(commands)
+        # a window that settled elsewhere is good enough for a layout but not for the probe
+        wait_for_moves([target])
+        geometry = get_window_geometries().get(window)
+        return geometry is not None and is_in_place(geometry, target[1:])
+
+    # moving and resizing in one step
+    combined = dict(SAFE_STRATEGY, combined=True)
+    strategy["combined"] = all([follows(move_window_commands(*target, combined), target) for target in targets])
+
+    # moving a maximized window without unmaximizing it first, windows that can not be maximized tell nothing
+    run_commands(["wmctrl -i -r " + window_arg(window) + " -b add,maximized_vert,maximized_horz"])
+    time.sleep(MoveTimeout / 2)
+    if is_maximized(window):
+        moved = follows(move_window_commands(*targets[0], dict(strategy, unmaximize=False)), targets[0])
+        strategy["unmaximize"] = not moved or is_maximized(window)
     else:
-        if new_width < MaxWidth / Monitors - WinBorder:
-            PosX = MaxWidth / Monitors + OrigX + new_width
-        else:
-            PosX = OrigX + MaxWidth / Monitors
+        log.info("The active window can not be maximized, keeping the unmaximize step")
+
+    move_windows([[get_reported_move(window, original)]])
+    if was_maximized:
+        run_commands(["wmctrl -i -r " + window_arg(window) + " -b add,maximized_vert,maximized_horz"])
+
+    return strategy
+
+
+def get_move_strategy(refresh=False, probe=True):
+    """
+    Returns the move strategy of the running window manager, probed once per window manager name and version.
+    Without probe a window manager that was not probed yet gets UNPROBED_STRATEGY.
+    """
+    name, version = get_window_manager()
+    if not name:
+        return SAFE_STRATEGY
+    if name.lower() in KNOWN_STRATEGIES:
+        return KNOWN_STRATEGIES[name.lower()]
+
+    key = name + " " + version
+    cache = retrieve(get_wm_cache_file())
+    if refresh or key not in cache:
+        if not probe:
+            return UNPROBED_STRATEGY
+        active = get_active_window()
+        if not active:
+            return SAFE_STRATEGY
+        log.info("Probing " + name + " for the fastest working move sequence")
+        cache[key] = probe_move_strategy(active)
+        store(cache, get_wm_cache_file())
+
+    log.debug("move strategy for %s: %s" % (name, cache[key]))
+    return cache[key]
+
+
+def get_strategy(probe=False):
+    """
+    Returns the move strategy of this run, looked up on first use. Only options that lay out or move windows pass
+    probe, so no other option moves the active window to probe the window manager.
+    """
+    global Strategy
+    if Strategy is None or (probe and Strategy is UNPROBED_STRATEGY):
+        # moves made while probing use the safe sequence
+        Strategy = UNPROBED_STRATEGY
+        Strategy = get_move_strategy(probe=probe) if ProbeWM else SAFE_STRATEGY
+    return Strategy
+
+
+def get_next_posx(monitor, new_width):
+    if new_width < monitor[2] - WinBorder:
+        PosX = monitor[0] + new_width
+    else:
+        PosX = monitor[0]
 
     return PosX
 
@@ -416,162 +1294,149 @@ def top_option():
     """
     Place the active window along the top of the screen
     """
-    active = get_active_window()
-    Width = get_middle_Width(active)
-    Height = get_top_Height()
-    PosX = get_middle_PosX(active, Width)
-    PosY = get_top_PosY()
-    move_window(active, PosX, PosY, Width, Height)
-    raise_window(active)
+    place_active("top")
 
 
 def middle_option():
     """
     Place the active window in the middle of the screen
     """
-    active = get_active_window()
-    Width = get_middle_Width(active)
-    Height = get_middle_Height()
-    PosX = get_middle_PosX(active, Width)
-    PosY = get_middle_PosY()
-    move_window(active, PosX, PosY, Width, Height)
-    raise_window(active)
+    place_active("middle")
 
 
 def top_left_option():
     """
     Place the active window in the top left corner of the screen
     """
-    active = get_active_window()
-    Width = get_corner_Width(active)
-    Height = get_top_Height()
-    PosX = get_left_PosX(active, Width)
-    PosY = get_top_PosY()
-    move_window(active, PosX, PosY, Width, Height)
-    raise_window(active)
+    place_active("top_left")
 
 
 def top_right_option():
     """
     Place the active window in the top right corner of the screen
     """
-    active = get_active_window()
-    Width = get_corner_Width(active)
-    Height = get_top_Height()
-    PosX = get_right_PosX(active, Width)
-    PosY = get_top_PosY()
-    move_window(active, PosX, PosY, Width, Height)
-    raise_window(active)
+    place_active("top_right")
 
 
-def get_top_Height():
-    return get_bottom_Height()
+def get_top_Height(monitor):
+    return get_bottom_Height(monitor)
 
 
-def get_middle_Height():
-    return MaxHeight - WinTitle - WinBorder
+def get_middle_Height(monitor):
+    return monitor[3] - WinTitle - WinBorder
 
 
-def get_bottom_Height():
-    return MaxHeight / 2 - WinTitle - WinBorder
+def get_bottom_Height(monitor):
+    return monitor[3] / 2 - WinTitle - WinBorder
 
 
-def get_bottom_PosY():
-    return MaxHeight / 2 + OrigY + WinBorder / 2 - (BottomPadding) / WinBorder
+def get_bottom_PosY(monitor):
+    return monitor[3] / 2 + monitor[1] + WinBorder / 2 - (BottomPadding) / WinBorder
 
 
-def get_middle_PosY():
-    return get_top_PosY()
+def get_middle_PosY(monitor):
+    return get_top_PosY(monitor)
 
 
-def get_top_PosY():
-    return OrigY - TopPadding / WinBorder
+def get_top_PosY(monitor):
+    return monitor[1] - TopPadding / WinBorder
 
 
-def get_middle_Width(active):
-    return get_next_width(int(get_window_width_height(active)[0]), CENTER_WIDTHS) + WinBorder
+def get_middle_Width(active, monitor, step=1):
+    return get_next_width(get_window_width_height(active)[0], CENTER_WIDTHS, monitor, step) + WinBorder
 
 
-def get_corner_Width(active):
-    return get_next_width(int(get_window_width_height(active)[0]), CORNER_WIDTHS)
+def get_corner_Width(active, monitor, step=1):
+    return get_next_width(get_window_width_height(active)[0], CORNER_WIDTHS, monitor, step)
 
 
-def get_middle_PosX(active, Width):
-    return get_next_posx(int(get_window_x_y(active)[0]), (MaxWidth / Monitors - Width) / 2) + WinBorder / 4
+def get_middle_PosX(monitor, Width):
+    return get_next_posx(monitor, (monitor[2] - Width) / 2) + WinBorder / 4
 
 
-def get_right_PosX(active, Width):
-    return get_next_posx(int(get_window_x_y(active)[0]), MaxWidth / Monitors - Width) - (
-            RightPadding + LeftPadding) / WinBorder
+def get_right_PosX(monitor, Width):
+    return get_next_posx(monitor, monitor[2] - Width) - (RightPadding + LeftPadding) / WinBorder
 
 
-def get_left_PosX(active, Width):
-    return get_next_posx(int(get_window_x_y(active)[0]), 0)
+def get_left_PosX(monitor, Width):
+    return get_next_posx(monitor, 0)
 
 
-def bottom_option():
+GRID_SLOTS = {
+    # slot: (width, height, x position, y position)
+    "top": (get_middle_Width, get_top_Height, get_middle_PosX, get_top_PosY),
+    "middle": (get_middle_Width, get_middle_Height, get_middle_PosX, get_middle_PosY),
+    "bottom": (get_middle_Width, get_bottom_Height, get_middle_PosX, get_bottom_PosY),
+    "top_left": (get_corner_Width, get_top_Height, get_left_PosX, get_top_PosY),
+    "top_right": (get_corner_Width, get_top_Height, get_right_PosX, get_top_PosY),
+    "bottom_left": (get_corner_Width, get_bottom_Height, get_left_PosX, get_bottom_PosY),
+    "bottom_right": (get_corner_Width, get_bottom_Height, get_right_PosX, get_bottom_PosY),
+    "left": (get_corner_Width, get_middle_Height, get_left_PosX, get_middle_PosY),
+    "right": (get_corner_Width, get_middle_Height, get_right_PosX, get_middle_PosY),
+}
+
+
+def get_slot_move(window, slot, step=1):
     """
-    Place the active window along the bottom of the screen
+    Returns the move that places the given window in the given grid slot, step selects the next width for repeated
+    calls
+    """
+    width_function, height_function, posx_function, posy_function = GRID_SLOTS[slot]
+    monitor = MonitorAreas[get_window_monitor(window)]
+    Width = width_function(window, monitor, step)
+    Height = height_function(monitor)
+    PosX = posx_function(monitor, Width)
+    PosY = posy_function(monitor)
+    return window, PosX, PosY, Width, Height
+
+
+def place_window(window, slot, step=1):
     """
+    Place the given window in the given grid slot, step selects the next width for repeated calls
+    """
+    move_window(*get_slot_move(window, slot, step))
+
+
+def place_active(slot):
+    get_strategy(probe=True)
     active = get_active_window()
-    Width = get_middle_Width(active)
-    Height = get_bottom_Height()
-    PosX = get_middle_PosX(active, Width)
-    PosY = get_bottom_PosY()
-    move_window(active, PosX, PosY, Width, Height)
+    place_window(active, slot)
     raise_window(active)
 
 
+def bottom_option():
+    """
+    Place the active window along the bottom of the screen
+    """
+    place_active("bottom")
+
+
 def bottom_right_option():
     """
     Place the active window in the bottom right corner of the screen
     """
-    active = get_active_window()
-    Width = get_corner_Width(active)
-    Height = get_bottom_Height()
-    PosX = get_right_PosX(active, Width)
-    PosY = get_bottom_PosY()
-    move_window(active, PosX, PosY, Width, Height)
-    raise_window(active)
+    place_active("bottom_right")
 
 
 def bottom_left_option():
     """
     Place the active window in the bottom left corner of the screen
     """
-    active = get_active_window()
-    Width = get_corner_Width(active)
-    Height = get_bottom_Height()
-    PosX = get_left_PosX(active, Width)
-    PosY = get_bottom_PosY()
-    move_window(active, PosX, PosY, Width, Height)
-    raise_window(active)
+    place_active("bottom_left")
 
 
 def left_option():
     """
     Place the active window in the left corner of the screen
     """
-    active = get_active_window()
-    Width = get_corner_Width(active)
-    Height = get_middle_Height()
-    PosX = get_left_PosX(active, Width)
-    PosY = get_middle_PosY()
-    move_window(active, PosX, PosY, Width, Height)
-    raise_window(active)
+    place_active("left")
 
 
 def right_option():
     """
     Place the active window in the right corner of the screen
     """
-    active = get_active_window()
-    Width = get_corner_Width(active)
-    Height = get_middle_Height()
-    PosX = get_right_PosX(active, Width)
-    PosY = get_middle_PosY()
-    move_window(active, PosX, PosY, Width, Height)
-    raise_window(active)
+    place_active("right")
 
 
 def compare_win_list(newlist, oldlist):
@@ -591,32 +1456,130 @@ def create_win_list():
     if OldWinList == {}:
         pass
     else:
-        OldWindows = OldWinList[Desktop]
+        OldWindows = OldWinList.get(Desktop, [])
         if Windows == OldWindows:
             pass
         else:
             Windows = compare_win_list(Windows, OldWindows)
 
-    for win in Windows:
-        if not is_valid_window(win):
-            Windows.remove(win)
+    Windows = lfilter(is_tiled_window, Windows)
 
-    return Windows
+    # windows pinned by a master rule always lead the list
+    pinned = lfilter(lambda y: window_rule(y) == "master", Windows)
+    return pinned + lfilter(lambda y: y not in pinned, Windows)
+
+
+def place_slotted_windows():
+    """
+    Place the windows of the current desktop that have a slot rule in their grid slot
+    """
+    moves = []
+    for win in WinList[Desktop]:
+        rule = window_rule(win)
+        if rule is not None and rule.startswith("slot:") and is_valid_window(win):
+            moves.append(get_slot_move(win, rule[5:], step=0))
+
+    # moved and confirmed like the tiled windows, so the undo history sees the geometry wmctrl reports
+    if moves:
+        move_windows([moves])
 
 
 def arrange(layout, windows):
-    for win, lay in zip(windows, layout):
-        move_window(win, lay[0], lay[1], lay[2], lay[3])
+    """
+    Tile the given windows using the given layout function separately on every monitor
+    """
+    get_strategy(probe=True)
+    before = {win: Registry[win].geometry for win in WinList[Desktop] if win in Registry}
+    parts = [[] for _ in LayoutAreas]
+    for win in windows:
+        parts[get_window_monitor(win) if len(LayoutAreas) > 1 else 0].append(win)
+
+    batches = []
+    for area, part in zip(LayoutAreas, parts):
+        if part:
+            batches.append([(win,) + tuple(lay) for win, lay in zip(part, layout(len(part), area))])
+
+    move_windows(batches)
+    place_slotted_windows()
+    if layout is not get_max_all:
+        persist_layout(layout.__name__)
+    record_history(Desktop, WinList[Desktop], windows, before)
     WinList[Desktop] = windows
     store(WinList, TempFile)
 
 
+def record_history(desktop, old_order, new_order, before):
+    """
+    Record the windows whose geometry changed, and the order only if it changed, in the bounded undo ring
+    """
+    changes = {}
+    for win, geometry in before.items():
+        if win in Registry and Registry[win].geometry != geometry:
+            changes[win] = (geometry, Registry[win].geometry)
+
+    if not changes and old_order == new_order:
+        return
+
+    import pickle
+
+    # the order is only kept when it changed, two full lists would dominate the size of most deltas
+    if old_order == new_order:
+        old_order = new_order = None
+    delta = (desktop, old_order, new_order, changes)
+    history = retrieve(TempFile + "_history")
+    undo = history.get("undo", [])
+    undo.append((len(pickle.dumps(delta)), delta))
+    while undo and sum(size for size, _ in undo) > UndoSize:
+        undo.pop(0)
+
+    # a new change makes the undone ones unreachable
+    store({"undo": undo, "redo": []}, TempFile + "_history")
+
+
+def apply_history(source, target, side):
+    """
+    Move the windows of the last delta of the source ring to the given side of it and move it to the target ring
+    """
+    history = retrieve(TempFile + "_history")
+    if not history.get(source):
+        log.warning("Nothing to " + source)
+        return
+
+    size, delta = history[source].pop()
+    desktop, old_order, new_order, changes = delta
+    moves = [get_reported_move(win, geometries[side]) for win, geometries in changes.items() if win in Registry]
+    move_windows([moves])
+    log.info("%s: moved %d windows" % (source, len(moves)))
+
+    history.setdefault(target, []).append((size, delta))
+    store(history, TempFile + "_history")
+
+    if desktop in WinList and old_order is not None:
+        order = old_order if side == 0 else new_order
+        WinList[desktop] = lfilter(lambda y: y in Registry, order)
+        store(WinList, TempFile)
+
+
+def undo_option():
+    """
+    Undo the last layout change
+    """
+    apply_history("undo", "redo", 0)
+
+
+def redo_option():
+    """
+    Redo the last undone layout change
+    """
+    apply_history("redo", "undo", 1)
+
+
 def simple_option():
     """
     The basic tiling layout . 1 Main + all other at the side.
     """
     Windows = create_win_list()
-    arrange(get_simple_tile(len(Windows)), Windows)
+    arrange(get_simple_tile, Windows)
 
 
 def simple_col_option():
@@ -624,38 +1587,139 @@ def simple_col_option():
     The basic tiling layout . 1 Main + all other at the side (*Column).
     """
     Windows = create_win_list()
-    arrange(get_column_tile(len(Windows)), Windows)
+    arrange(get_column_tile, Windows)
+
+
+def grid_option():
+    """
+    Tile all windows in an evenly sized grid, for many windows
+    """
+    Windows = create_win_list()
+    arrange(get_grid_tile, Windows)
+
+
+def mosaic_option():
+    """
+    Tile all windows in a grid, windows of an incomplete last row share its width
+    """
+    Windows = create_win_list()
+    arrange(get_mosaic_tile, Windows)
+
+
+def get_window_geometry(window):
+    """
+    Returns the given window's (x, y, width, height) from the registry, asking xwininfo for windows it does not know
+    """
+    record = Registry.get(window)
+    if record is None or not record.width:
+        return tuple(get_window_x_y(window) + get_window_width_height(window))
+    return record.geometry
 
 
 def swap_windows(window1, window2):
     """
     Swap window1 and window2
     """
-    window1_area = lmap(lambda y: int(y), get_window_width_height(window1))
-    window1_position = lmap(lambda y: int(y) - WinBorder / 2, get_window_x_y(window1))
-    window2_area = lmap(lambda y: int(y), get_window_width_height(window2))
-    window2_position = lmap(lambda y: int(y) - WinBorder / 2, get_window_x_y(window2))
+    get_strategy(probe=True)
+    window1_geometry = get_window_geometry(window1)
+    window2_geometry = get_window_geometry(window2)
 
-    move_window(window1, window2_position[0], window2_position[1] - WinTitle, window2_area[0], window2_area[1])
-    move_window(window2, window1_position[0], window1_position[1] - WinTitle, window1_area[0], window1_area[1])
+    move_windows([[get_reported_move(window1, window2_geometry), get_reported_move(window2, window1_geometry)]])
 
 
 def get_largest_window():
     """
     Returns the window id of the window with the largest area
     """
-    winlist = create_win_list()
+    return Registry.index(Desktop).largest()
+
+
+def get_slot_window(slot, window):
+    """
+    Returns the window whose centre lies in the given grid slot on the monitor of the given window, or None
+    """
+    _, x, y, width, height = get_slot_move(window, slot, step=0)
+    left, top, width, height = get_reported_geometry(x, y, width, height)
+    return Registry.index(Desktop).at(left, top, left + width, top + height)
+
+
+def get_neighbour_window(window, direction):
+    """
+    Returns the closest window left, right, up or down of the given window, or None
+    """
+    x, y, width, height = get_window_geometry(window)
+    return Registry.index(Desktop).neighbour(x + width // 2, y + height // 2, direction, window)
+
+
+def focus_neighbour(direction):
+    active = get_active_window()
+    neighbour = get_neighbour_window(active, direction) if active else None
+    if neighbour is not None:
+        raise_window(neighbour)
+
+
+def swap_neighbour(direction):
+    active = get_active_window()
+    neighbour = get_neighbour_window(active, direction) if active else None
+    if neighbour is not None:
+        swap_windows(active, neighbour)
+        raise_window(active)
 
-    max_area = 0
-    max_win = winlist[0]
 
-    for win in winlist:
-        win_area = lreduce(lambda x, y: int(x) * int(y), get_window_width_height(win))
-        if win_area > max_area:
-            max_area = win_area
-            max_win = win
+def focus_left_option():
+    """
+    Focus the closest window left of the active window
+    """
+    focus_neighbour("left")
 
-    return max_win
+
+def focus_right_option():
+    """
+    Focus the closest window right of the active window
+    """
+    focus_neighbour("right")
+
+
+def focus_up_option():
+    """
+    Focus the closest window above the active window
+    """
+    focus_neighbour("up")
+
+
+def focus_down_option():
+    """
+    Focus the closest window below the active window
+    """
+    focus_neighbour("down")
+
+
+def swap_left_option():
+    """
+    Swap the active window with the closest window left of it
+    """
+    swap_neighbour("left")
+
+
+def swap_right_option():
+    """
+    Swap the active window with the closest window right of it
+    """
+    swap_neighbour("right")
+
+
+def swap_up_option():
+    """
+    Swap the active window with the closest window above it
+    """
+    swap_neighbour("up")
+
+
+def swap_down_option():
+    """
+    Swap the active window with the closest window below it
+    """
+    swap_neighbour("down")
 
 
 def swap_grid_option():
@@ -665,8 +1729,9 @@ def swap_grid_option():
     active_window = get_active_window()
     largest_window = get_largest_window()
 
-    swap_windows(active_window, largest_window)
-    raise_window(active_window)
+    if largest_window is not None:
+        swap_windows(active_window, largest_window)
+        raise_window(active_window)
 
 
 def swap_option():
@@ -676,8 +1741,10 @@ def swap_option():
     winlist = create_win_list()
     active = get_active_window()
     winlist.remove(active)
-    winlist.insert(0, active)
-    arrange(retrieve_last_used_layout()(len(winlist)), winlist)
+    # windows pinned by a master rule stay ahead of the active window
+    pinned = lfilter(lambda y: window_rule(y) == "master", winlist)
+    winlist.insert(0 if window_rule(active) == "master" else len(pinned), active)
+    arrange(retrieve_last_used_layout(), winlist)
 
 
 def vertical_option():
@@ -688,7 +1755,7 @@ def vertical_option():
     active = get_active_window()
     winlist.remove(active)
     winlist.insert(0, active)
-    arrange(get_vertical_tile(len(winlist)), winlist)
+    arrange(get_vertical_tile, winlist)
 
 
 def horizontal_option():
@@ -699,7 +1766,15 @@ def horizontal_option():
     active = get_active_window()
     winlist.remove(active)
     winlist.insert(0, active)
-    arrange(get_horiz_tile(len(winlist)), winlist)
+    arrange(get_horiz_tile, winlist)
+
+
+def count_pinned(winlist):
+    """
+    Return the number of windows pinned as master at the head of the given list, cycling leaves those in place
+    """
+    pinned = len(lfilter(lambda y: window_rule(y) == "master", winlist))
+    return pinned if pinned < len(winlist) else 0
 
 
 def cycle_option():
@@ -707,9 +1782,9 @@ def cycle_option():
     Cycle all the windows in the master pane
     """
     winlist = create_win_list()
-    winlist.insert(0, winlist[len(winlist) - 1])
-    winlist = winlist[:-1]
-    arrange(retrieve_last_used_layout()(len(winlist)), winlist)
+    pinned = count_pinned(winlist)
+    winlist = winlist[:pinned] + winlist[-1:] + winlist[pinned:-1]
+    arrange(retrieve_last_used_layout(), winlist)
 
 
 def anticycle_option():
@@ -717,21 +1792,21 @@ def anticycle_option():
     Cycle all the windows in the master pane in reverse
     """
     winlist = create_win_list()
-    winlist.insert(len(winlist), winlist[0])
-    winlist = winlist[1:]
-    arrange(retrieve_last_used_layout()(len(winlist)), winlist)
+    pinned = count_pinned(winlist)
+    winlist = winlist[:pinned] + winlist[pinned + 1:] + winlist[pinned:pinned + 1]
+    arrange(retrieve_last_used_layout(), winlist)
 
 
 def maximize_option():
     """
     Maximize the active window
     """
-    Width = MaxWidth
-    Height = MaxHeight - WinTitle - WinBorder
-    PosX = LeftPadding
-    PosY = TopPadding
+    # the monitor the window is on, like max_all
+    window = get_focused_window()
+    PosX, PosY, Width, Height = LayoutAreas[get_window_monitor(window) if len(LayoutAreas) > 1 else 0]
+    Height = Height - WinTitle - WinBorder
     move_active(PosX, PosY, Width, Height)
-    raise_window(":ACTIVE:")
+    raise_window(TargetWindow or ":ACTIVE:")
 
 
 def max_all_option():
@@ -742,7 +1817,135 @@ def max_all_option():
     active = get_active_window()
     winlist.remove(active)
     winlist.insert(0, active)
-    arrange(get_max_all(len(winlist)), winlist)
+    arrange(get_max_all, winlist)
+
+
+def probe_option():
+    """
+    Probe the window manager again for the fastest working move sequence, using the active window
+    """
+    global Strategy
+    Strategy = UNPROBED_STRATEGY
+    Strategy = get_move_strategy(refresh=True)
+    log.info("Move strategy: %s" % Strategy)
+
+
+def monitors_option():
+    """
+    Detect the monitor layout again, use after changing monitors without changing the screen size
+    """
+    monitors = get_monitors(Screen, refresh=True)
+    log.info("Detected %d monitors: %s" % (len(monitors), monitors))
+
+
+def snapshot_option():
+    """
+    Record the desktop, geometry and order of every window
+    """
+    windows = {}
+    for winlist in WinList.values():
+        for win in winlist:
+            record = Registry[win]
+            windows[win] = (record.desktop, record.geometry, record.wm_class, record.title)
+
+    snapshot_file = get_snapshot_file()
+    store({"windows": windows, "order": WinList}, snapshot_file)
+    log.info("Recorded %d windows to %s" % (len(windows), snapshot_file))
+
+
+def match_snapshot_windows(snapshot):
+    """
+    Map the windows of the given snapshot to current windows, by id or else by class and title
+    """
+    by_name = {}
+    for record in Registry.values():
+        by_name.setdefault((record.wm_class, record.title), []).append(record.wid)
+
+    matches = {win: win for win in snapshot if win in Registry}
+    used = set(matches.values())
+    for win, (_, _, wm_class, title) in snapshot.items():
+        if win not in matches:
+            candidates = lfilter(lambda y: y not in used, by_name.get((wm_class, title), []))
+            if candidates:
+                matches[win] = candidates[0]
+                used.add(candidates[0])
+
+    return matches
+
+
+def restore_option():
+    """
+    Restore the desktop, geometry and order of every window from the last snapshot
+    """
+    snapshot = retrieve(get_snapshot_file())
+    if not snapshot:
+        log.warning("No snapshot to restore, use the snapshot option first")
+        return
+
+    matches = match_snapshot_windows(snapshot["windows"])
+    commands = []
+    moves = []
+    for saved_win, win in matches.items():
+        desktop, geometry, _, _ = snapshot["windows"][saved_win]
+        current = Registry[win]
+        if desktop != current.desktop and desktop != -1:
+            commands.append("wmctrl -i -r " + window_arg(win) + " -t " + str(desktop))
+            Registry.set_desktop(win, desktop)
+        if geometry != current.geometry:
+            moves.append(get_reported_move(win, geometry))
+
+    run_commands(commands)
+    move_windows([moves])
+    log.info("Restored %d of %d windows" % (len(matches), len(snapshot["windows"])))
+
+    restored = set(matches.values())
+    for desk in WinList:
+        order = [matches[win] for win in snapshot["order"].get(desk, []) if win in matches]
+        WinList[desk] = order + lfilter(lambda y: y not in restored, WinList[desk])
+    store(WinList, TempFile)
+
+
+def batch_option(file="-"):
+    """
+    Run the options listed in a file or stdin one per line, each optionally followed by a target window id
+    """
+    global PendingStores, TargetWindow, OldWinList
+
+    if file == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(file) as batch_file:
+            lines = batch_file.read().splitlines()
+
+    PendingStores = {}
+    try:
+        for line in lines:
+            fields = line.split("#", 1)[0].split()
+            if not fields:
+                continue
+            if fields[0] == "batch":
+                log.warning("Ignoring nested batch: " + line)
+                continue
+            try:
+                TargetWindow = int(fields[1], 16) if len(fields) > 1 else 0
+            except ValueError as _:
+                log.warning("Ignoring invalid window id: " + line)
+                continue
+
+            log.info("batch: " + line.strip())
+            try:
+                eval_function(fields[0] + "_option")
+            except Exception as err:
+                # like separate invocations, a failing step does not stop the ones after it
+                log.error("batch step failed: %s (%s: %s)" % (line.strip(), type(err).__name__, err))
+                continue
+            # the next step starts from the window order this one left behind
+            OldWinList = {desk: list(winlist) for desk, winlist in WinList.items()}
+    finally:
+        TargetWindow = 0
+        pending, PendingStores = PendingStores, None
+        for pending_file, ob in pending.items():
+            store(ob, pending_file)
 
 
 def create_desktop(name: str, comment: str):
@@ -770,6 +1973,7 @@ def create_desktops_option():
     for k, v in globals().items():
         if (k.endswith("_option")
                 and k != "create_desktops_option"
+                and k != "batch_option"
                 and k != "version_option"
                 and k != "help_option"):
             create_desktop(k.rsplit("_", 1)[0], v.__doc__.strip())
@@ -837,13 +2041,13 @@ def initialize_global_variables():
     # Window Decoration
     global WinTitle, WinBorder
     # Grid Layout
-    global CORNER_WIDTHS, CENTER_WIDTHS, Monitors, WidthAdjustment
+    global CORNER_WIDTHS, CENTER_WIDTHS, Monitors, MonitorAreas, LayoutAreas, WidthAdjustment
     # Simple Layout
     global MwFactor
     # System Desktop and Screen Information
-    global MaxWidth, MaxHeight, OrigX, OrigY, Desktop, WinList, OldWinList
+    global MaxWidth, MaxHeight, OrigX, OrigY, Desktop, Screen, WinList, OldWinList
     # Miscellaneous
-    global TempFile, WindowFilter
+    global TempFile, WindowFilter, MoveTimeout, UndoSize, ProbeWM, Strategy, Rules
 
     Config = initconfig()
     cfgSection = "DEFAULT"
@@ -860,10 +2064,16 @@ def initialize_global_variables():
     WinBorder = Config.getint(cfgSection, "WinBorder")
     MwFactor = Config.getfloat(cfgSection, "MwFactor")
     TempFile = Config.get(cfgSection, "TempFile")
+    if TempFile in ("", LEGACY_TEMP_FILE):
+        TempFile = os.path.join(get_state_dir(), "winlist")
     Monitors = Config.getint(cfgSection, "Monitors")
     WidthAdjustment = Config.getfloat(cfgSection, "WidthAdjustment")
     WindowFilter = Config.getboolean(cfgSection, "WindowFilter")
+    MoveTimeout = Config.getfloat(cfgSection, "MoveTimeout")
+    UndoSize = Config.getint(cfgSection, "UndoSize")
+    ProbeWM = Config.getboolean(cfgSection, "ProbeWM")
     CORNER_WIDTHS = lmap(lambda y: float(y), Config.get(cfgSection, "GridWidths").split(","))
+    Rules = compile_rules(Config)
 
     # create the opposite section for each corner_width
     opposite_widths = []
@@ -882,49 +2092,61 @@ def initialize_global_variables():
     CENTER_WIDTHS = list(set(CENTER_WIDTHS))  # filter dups
     CENTER_WIDTHS.sort()
 
-    # Handle multiple monitors
-    CORNER_WIDTHS = lmap(lambda y: round(y / Monitors, 2) + WidthAdjustment, CORNER_WIDTHS)
-    CENTER_WIDTHS = lmap(lambda y: round(y / Monitors, 2) + WidthAdjustment, CENTER_WIDTHS)
+    # widths are relative to the monitor the window is on
+    CORNER_WIDTHS = lmap(lambda y: y + WidthAdjustment, CORNER_WIDTHS)
+    CENTER_WIDTHS = lmap(lambda y: y + WidthAdjustment, CENTER_WIDTHS)
 
     log.debug("corner widths: %s" % CORNER_WIDTHS)
     log.debug("center widths: %s" % CENTER_WIDTHS)
 
-    (Desktop, OrigXstr, OrigYstr, MaxWidthStr, MaxHeightStr, WinList) = initialize()
+    (Desktop, Screen, OrigXstr, OrigYstr, MaxWidthStr, MaxHeightStr, WinList) = initialize()
     MaxWidth = int(MaxWidthStr) - LeftPadding - RightPadding
     MaxHeight = int(MaxHeightStr) - TopPadding - BottomPadding
     OrigX = int(OrigXstr) + LeftPadding
     OrigY = int(OrigYstr) + TopPadding
     OldWinList = retrieve(TempFile)
 
+    # Handle multiple monitors
+    monitors = get_monitors(Screen)
+    MonitorAreas = get_monitor_areas(monitors)
+    # without RandR information the layouts keep spanning the whole work area
+    LayoutAreas = MonitorAreas if monitors else [(OrigX, OrigY, MaxWidth, MaxHeight)]
 
-def main():
-    print(BANNER)
-    if len(sys.argv) == 1:
-        help_option()
-        sys.exit(1)
+    # looked up on the first move, see get_strategy
+    Strategy = None
 
+
+def main():
     for arg in sys.argv:
         if arg == sys.argv[0]:
             continue
+        elif arg == "-":
+            # stdin as the file of batch, not a flag
+            continue
         elif arg.startswith("-"):
             eval_function(arg.split("-")[1] + "_flag")
 
+    if sys.stdout.isatty() or log.level <= DEBUG:
+        print(BANNER)
+    if len(sys.argv) == 1:
+        help_option()
+        sys.exit(1)
+
     required_programs = ["wmctrl", "xprop", "xwininfo", "egrep", "grep"]
     if not has_required_programs(required_programs):
         sys.exit(1)
 
     initialize_global_variables()
 
-    for arg in sys.argv:
-        if arg == sys.argv[0]:
-            continue
-        elif arg.startswith("-"):
-            continue
+    options = lfilter(lambda y: y == "-" or not y.startswith("-"), sys.argv[1:])
+    while options:
+        option = options.pop(0)
+        if option == "batch":
+            # batch reads its options from the file that follows it, or stdin
+            batch_option(options.pop(0) if options else "-")
         else:
-            eval_function(arg + "_option")
+            eval_function(option + "_option")
 
 
 if __name__ == "__main__":
     main()
-else:
-    log.warning("Importing is not fully tested.  Use at your own risk.")